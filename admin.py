@@ -0,0 +1,290 @@
+"""
+Admin endpoints to find out what is using the memory and the time of a worker
+
+    GET    /admin/memory            memory used by the dataset and the caches
+    POST   /admin/profile           profile the next callbacks, with
+                                    ?kind=cprofile|tracemalloc&callbacks=<n>
+    GET    /admin/profile           state of the profiler
+    DELETE /admin/profile           stop profiling and save what there is
+    GET    /admin/profiles          finished profiles
+    GET    /admin/profiles/<name>   download one; `?format=text` for a
+                                    readable version of a cProfile profile
+
+They only exist if ADMIN_TOKEN is set, and need it as a bearer token
+(`Authorization: Bearer <token>`). Every gunicorn worker has its own memory and
+profiler, so the responses say which process they come from. Finished profiles
+are saved to PROFILE_DIR, so any worker can serve them.
+"""
+import hmac
+import io
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from cProfile import Profile
+
+import pandas as pd
+from flask import Blueprint, Response, abort, request, send_from_directory
+
+import cache
+from config import DATASET
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "odi-app-profiles")
+)
+
+# frames kept per allocation by tracemalloc
+TRACEMALLOC_FRAMES = 10
+
+admin_api = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+def deep_size(obj):
+    """
+    bytes used by obj, including the python objects in object columns
+    """
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if isinstance(obj, dict):
+        return sum(deep_size(v) for v in obj.values())
+    return sys.getsizeof(obj)
+
+
+def process_memory():
+    """
+    resident memory of this process, and the part of it which is not shared
+    with other processes (e.g. with the other workers, for a preloaded app)
+    """
+    res = {"pid": os.getpid()}
+    try:
+        with open("/proc/self/smaps_rollup") as fh:
+            fields = dict(line.split(":", 1) for line in fh if ":" in line)
+    except OSError:
+        return res
+
+    def kb(k):
+        return int(fields.get(k, "0 kB").split()[0]) * 1024
+
+    res["rss_bytes"] = kb("Rss")
+    res["private_bytes"] = kb("Private_Clean") + kb("Private_Dirty")
+    return res
+
+
+def memory_report(dataset):
+    outputs, stores = {}, {}
+    for key, output in dataset.data.items():
+        if not key.startswith("output_"):
+            continue
+        sizes = {store: deep_size(table) for store, table in output.items()}
+        outputs[key[len("output_"):]] = sum(sizes.values())
+        for store, size in sizes.items():
+            stores[store] = stores.get(store, 0) + size
+    param_df = deep_size(dataset.param_df)
+
+    def largest_first(sizes):
+        return dict(sorted(sizes.items(), key=lambda x: -x[1]))
+
+    return {
+        "process": process_memory(),
+        "dataset": {
+            "version": dataset.version,
+            "bytes": sum(outputs.values()) + param_df,
+            "param_df_bytes": param_df,
+            "stores": largest_first(stores),
+            "outputs": largest_first(outputs),
+        },
+        "caches": [c.stats() for c in cache.CACHES],
+    }
+
+
+class CallbackProfiler:
+    """
+    Profiles the next few callbacks, either with cProfile (where the time goes)
+    or with tracemalloc (the memory allocated meanwhile and not freed again).
+    Does nothing until started, so it can stay around the callbacks all the time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.kind = None
+        self.remaining = 0
+        self.profiled = 0
+        self.started = None
+        self.last = None
+        self._lock = threading.Lock()
+        # cProfile can only profile one thread at a time
+        self._profiling = threading.Lock()
+        self._stats = None
+        self._snapshot = None
+
+    def state(self):
+        return {
+            "pid": os.getpid(),
+            "kind": self.kind,
+            "remaining": self.remaining,
+            "profiled": self.profiled,
+            "last": self.last,
+        }
+
+    def start(self, kind, callbacks):
+        with self._lock:
+            if self.kind is not None:
+                raise RuntimeError("already profiling")
+            if kind == "tracemalloc":
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._snapshot = tracemalloc.take_snapshot()
+            self.kind = kind
+            self.remaining = callbacks
+            self.profiled = 0
+            self.started = time.time()
+            self._stats = None
+
+    @contextmanager
+    def callback(self):
+        if self.kind == "cprofile" and self._profiling.acquire(blocking=False):
+            profile = Profile()
+            try:
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+                    self._done(profile)
+            finally:
+                self._profiling.release()
+        elif self.kind == "tracemalloc":
+            try:
+                yield
+            finally:
+                self._done()
+        else:
+            yield
+
+    def _done(self, profile=None):
+        with self._lock:
+            if self.remaining <= 0:
+                return
+            if profile is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+            self.profiled += 1
+            self.remaining -= 1
+            if self.remaining == 0:
+                self._finish()
+
+    def stop(self):
+        with self._lock:
+            if self.kind is None:
+                return None
+            return self._finish()
+
+    def _finish(self):
+        """
+        saves the profile to the profile directory; needs self._lock
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = "{}-{}-{}".format(
+            self.kind, os.getpid(), time.strftime("%Y%m%dT%H%M%S", time.gmtime(self.started))
+        )
+        if self.kind == "cprofile":
+            name += ".prof"
+            if self._stats is not None:
+                self._stats.dump_stats(os.path.join(self.directory, name))
+            else:
+                name = None
+        else:
+            name += ".txt"
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            diff = snapshot.compare_to(self._snapshot, "traceback")
+            with open(os.path.join(self.directory, name), "w") as fh:
+                fh.write(
+                    "memory allocated during {} callbacks and not freed, largest first\n\n".format(
+                        self.profiled
+                    )
+                )
+                for stat in diff[:50]:
+                    fh.write("{}\n".format(stat))
+                    fh.write("".join("    {}\n".format(line) for line in stat.traceback.format()))
+            self._snapshot = None
+        self.kind = None
+        self.remaining = 0
+        self._stats = None
+        self.last = name
+        return name
+
+
+PROFILER = CallbackProfiler(PROFILE_DIR)
+
+
+def _json(obj, status=200):
+    # keeps the order of the keys, unlike flask.jsonify
+    return Response(json.dumps(obj, indent=2), status=status, mimetype="application/json")
+
+
+@admin_api.before_request
+def _check_token():
+    # without a token the admin endpoints don't exist
+    if not ADMIN_TOKEN:
+        abort(404)
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode("utf-8"), ("Bearer " + ADMIN_TOKEN).encode("utf-8")):
+        abort(401)
+
+
+@admin_api.route("/memory")
+def memory():
+    return _json(memory_report(DATASET.current()))
+
+
+@admin_api.route("/profile", methods=["GET", "POST", "DELETE"])
+def profile():
+    if request.method == "POST":
+        kind = request.args.get("kind", "cprofile")
+        if kind not in ("cprofile", "tracemalloc"):
+            abort(400, "kind must be cprofile or tracemalloc")
+        try:
+            callbacks = int(request.args.get("callbacks", 20))
+        except ValueError:
+            abort(400, "callbacks must be a number")
+        if callbacks < 1:
+            abort(400, "callbacks must be at least 1")
+        try:
+            PROFILER.start(kind, callbacks)
+        except RuntimeError as e:
+            abort(409, str(e))
+        return _json(PROFILER.state(), 202)
+    if request.method == "DELETE":
+        PROFILER.stop()
+    return _json(PROFILER.state())
+
+
+@admin_api.route("/profiles")
+def profiles():
+    try:
+        names = sorted(os.listdir(PROFILE_DIR))
+    except OSError:
+        names = []
+    return _json(names)
+
+
+@admin_api.route("/profiles/<name>")
+def download_profile(name):
+    if request.args.get("format") == "text" and name.endswith(".prof"):
+        path = os.path.join(PROFILE_DIR, os.path.basename(name))
+        if not os.path.isfile(path):
+            abort(404)
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(50)
+        return Response(out.getvalue(), mimetype="text/plain")
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
@@ -0,0 +1,62 @@
+/*
+ * Greys out and disables the number of companies hit by a privacy shock while
+ * the shock is switched off. This runs in the browser, so toggling the shock
+ * does not need a request to the server. The styles for both cases are
+ * ABLED_STYLE_RADIO and DISABLED_STYLE_RADIO from config.py, which the layout
+ * puts on the hidden "shock-styles" element.
+ *
+ * This writes input.disabled and the label styles directly into the DOM of
+ * the shock-num RadioItems, which React controls. React does not know about
+ * these changes: they stay until React re-renders those elements, and a
+ * re-render from the server puts back the styles it was given. So whatever
+ * re-renders shock-num from a callback has to render it with the right
+ * styles itself, as the most different callback does (with a new key, so
+ * React builds it from scratch). Checked with dash-renderer 0.21 / React 15.
+ */
+(function () {
+  "use strict";
+
+  var SCENARIOS = ["scen1", "scen2"];
+
+  function styles() {
+    var el = document.getElementById("shock-styles");
+    return el && {
+      on: JSON.parse(el.getAttribute("data-enabled-style")),
+      off: JSON.parse(el.getAttribute("data-disabled-style"))
+    };
+  }
+
+  function update(scen) {
+    var toggle = document.getElementById(scen + "-privacy-onoff");
+    var radios = document.getElementById(scen + "-shock-num");
+    var s = styles();
+    if (!toggle || !radios || !s) {
+      return;
+    }
+    var on = toggle.querySelector("input").checked;
+    var style = on ? s.on : s.off;
+    var other = on ? s.off : s.on;
+    Array.prototype.forEach.call(radios.querySelectorAll("label"), function (label) {
+      Object.keys(other).forEach(function (k) {
+        if (!(k in style)) {
+          label.style.removeProperty(k);
+        }
+      });
+      Object.keys(style).forEach(function (k) {
+        label.style.setProperty(k, style[k]);
+      });
+    });
+    Array.prototype.forEach.call(radios.querySelectorAll("input"), function (input) {
+      input.disabled = !on;
+    });
+  }
+
+  document.addEventListener("change", function (event) {
+    SCENARIOS.forEach(function (scen) {
+      var toggle = document.getElementById(scen + "-privacy-onoff");
+      if (toggle && toggle.contains(event.target)) {
+        update(scen);
+      }
+    });
+  });
+})();
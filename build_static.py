@@ -0,0 +1,206 @@
+"""
+Builds a static version of the app which can be hosted without a python process
+
+    python build_static.py --out build/static
+
+Every figure is rendered once per output, with that output as both scenarios,
+and saved as a json shard named after the hash of its content. The page in
+static_site/ looks up the outputs for the chosen parameters in manifest.json
+and puts the figure together from the scenario 1 part of one shard and the
+scenario 2 part of the other, in the browser. A size report of the generated
+files is printed at the end and saved as size-report.json.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from html import escape
+from string import Template
+
+import plotly
+
+from config import DATASET, TAB_DICT, HOVERTEXTS, DISCLAIMER
+from dataset import SCENARIO_COLUMNS
+from shards import COMBINE, figure_shard
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SITE_DIR = os.path.join(HERE, "static_site")
+
+
+def dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def content_address(blob):
+    return hashlib.sha256(blob).hexdigest()[:20] + ".json"
+
+
+def render_output(idx):
+    """
+    returns {tab: (shard, layout)} of encoded json for one output
+    """
+    dataset = DATASET.current()
+    res = {}
+    for x, y in TAB_DICT.items():
+        shard = figure_shard(y["figure"], dataset.output(idx)[y["store"]])
+        layout = shard.pop("layout")
+        res[x] = (shard, dumps(layout).encode("utf-8"))
+    return res
+
+
+def sizes(blob):
+    # a CDN serves them gzipped
+    return len(blob), len(gzip.compress(blob))
+
+
+def write_shard(out, blob, written):
+    """
+    writes blob to the file named after its content, unless that has been written already
+    """
+    name = content_address(blob)
+    if name not in written:
+        with open(os.path.join(out, "shards", name), "wb") as fh:
+            fh.write(blob)
+        written[name] = sizes(blob)
+    return name
+
+
+def scenario_card(scen):
+    def radio(name, values, checked):
+        return "".join(
+            '<label><input type="radio" name="{0}-{1}" value="{2}"{3}> {4}</label>'.format(
+                scen, name, value, " checked" if value == checked else "", escape(str(label))
+            )
+            for label, value in values
+        )
+
+    def title(text, hovertext):
+        return '<p>{} <span class="question-mark" title="{}">?⃝</span></p>'.format(
+            text, escape(" ".join(HOVERTEXTS[hovertext].split()))
+        )
+
+    levels = [(x, x.lower()) for x in ["Low", "Medium", "High"]]
+    return (
+        '<div class="scenario-input" id="{0}">'.format(scen)
+        + title("Number of big companies:", "Number of big companies")
+        + '<div class="radio">{}</div>'.format(
+            radio("num-big-firms", [(x, str(x)) for x in [1, 2, 3, 4, "None"]], "1")
+        )
+        + title("Privacy concerns from customers:", "Privacy concern")
+        + '<div class="radio">{}</div>'.format(radio("privacy-concern", levels, "medium"))
+        + title(
+            "Consumer preference for multiple products from the same company:",
+            "Consumer preference for multiple products from the same company",
+        )
+        + '<div class="radio">{}</div>'.format(radio("loyalty", levels, "medium"))
+        + title("Openness:", "Openness")
+        + '<div class="radio">{}</div>'.format(radio("openness", levels, "medium"))
+        + title("Privacy shock", "Privacy shock")
+        + '<p class="small">(can be applied to several firms)</p>'
+        + '<label><input type="checkbox" name="{}-privacy-onoff"> Include a privacy shock</label>'.format(scen)
+        + '<div class="radio shock-num">{}</div>'.format(
+            radio("shock-num", [(x, str(x)) for x in [1, 2, 3, 4]], "1")
+        )
+        + "</div>"
+    )
+
+
+def size_report(out, written, bundle):
+    """
+    number and sizes of the generated files, raw and gzipped
+    """
+    groups = {}
+
+    def add(group, size):
+        g = groups.setdefault(group, {"files": 0, "bytes": 0, "gzip_bytes": 0})
+        g["files"] += 1
+        g["bytes"] += size[0]
+        g["gzip_bytes"] += size[1]
+
+    for group, files in written.items():
+        for size in files.values():
+            add(group, size)
+    for name in bundle:
+        with open(os.path.join(out, name), "rb") as fh:
+            add("page", sizes(fh.read()))
+    groups["total"] = {
+        k: sum(g[k] for g in groups.values()) for k in ["files", "bytes", "gzip_bytes"]
+    }
+    print("{:<10} {:>7} {:>12} {:>12}".format("", "files", "bytes", "gzipped"))
+    for group, g in groups.items():
+        print("{:<10} {:>7} {:>12,} {:>12,}".format(group, g["files"], g["bytes"], g["gzip_bytes"]))
+    with open(os.path.join(out, "size-report.json"), "w") as fh:
+        json.dump(groups, fh, indent=2)
+
+
+def build(out, jobs):
+    dataset = DATASET.current()
+    os.makedirs(os.path.join(out, "shards"), exist_ok=True)
+    outputs = [str(idx) for idx in dataset.param_df.index if dataset.has_output(str(idx))]
+
+    shards_written, layouts_written = {}, {}
+    shards = {x: {} for x in TAB_DICT}
+    # forked workers share the dataset which is already loaded
+    with multiprocessing.Pool(jobs) as pool:
+        for idx, res in zip(outputs, pool.imap(render_output, outputs, chunksize=8)):
+            for x, (shard, layout) in res.items():
+                # most figures have the same layout for every output, so
+                # layouts are shards of their own and only stored once
+                shard["layout"] = write_shard(out, layout, layouts_written)
+                shards[x][idx] = write_shard(out, dumps(shard).encode("utf-8"), shards_written)
+
+    scenarios = {}
+    for idx, row in zip(dataset.param_df.index, dataset.param_df[SCENARIO_COLUMNS].itertuples(index=False)):
+        if str(idx) in shards[next(iter(TAB_DICT))]:
+            scenarios.setdefault("|".join(str(v) for v in row), str(idx))
+    manifest = {
+        "version": dataset.version,
+        "scenario_columns": SCENARIO_COLUMNS,
+        "scenarios": scenarios,
+        "tabs": [
+            {
+                "id": x,
+                "label": y["label"],
+                "text": y["text"],
+                "combine": COMBINE.get(y["figure"], (None,))[0],
+            }
+            for x, y in TAB_DICT.items()
+        ],
+        "shards": shards,
+    }
+    with open(os.path.join(out, "manifest.json"), "w") as fh:
+        fh.write(dumps(manifest))
+
+    with open(os.path.join(SITE_DIR, "index.html")) as fh:
+        page = Template(fh.read()).substitute(
+            scenario_1=scenario_card("scen1"),
+            scenario_2=scenario_card("scen2"),
+            disclaimer=escape(DISCLAIMER.strip()).replace("\n\n", "</p><p>"),
+        )
+    with open(os.path.join(out, "index.html"), "w") as fh:
+        fh.write(page)
+    shutil.copy(os.path.join(SITE_DIR, "app.js"), out)
+    assets = sorted(os.listdir(os.path.join(HERE, "assets")))
+    os.makedirs(os.path.join(out, "assets"), exist_ok=True)
+    for name in assets:
+        shutil.copy(os.path.join(HERE, "assets", name), os.path.join(out, "assets"))
+
+    bundle = ["index.html", "app.js", "manifest.json"] + [
+        os.path.join("assets", name) for name in assets
+    ]
+    size_report(out, {"shards": shards_written, "layouts": layouts_written}, bundle)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--out", default="build/static")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+    build(args.out, args.jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+In-memory caches for things derived from the dataset
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# every cache created, so they can all be invalidated together
+CACHES = []
+
+
+class VersionedCache:
+    """
+    Thread safe LRU cache with a memory budget. Entries are keyed by the
+    dataset version they were computed from, so a new version of the dataset
+    never sees results computed from an old one.
+
+    sizeof(value) gives the (approximate) size of a value in bytes.
+    """
+
+    def __init__(self, name, max_bytes, sizeof):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # requests which waited for the same value to be computed by another thread
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        CACHES.append(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            versions = {version for version, _ in self._entries}
+        requests = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / requests if requests else None,
+            "versions": len(versions),
+        }
+
+    def contains(self, version, key):
+        """
+        like `(version, key) in cache`, but without counting as a hit or miss
+        """
+        return (version, key) in self._entries
+
+    def get(self, version, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._entries[(version, key)]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end((version, key))
+            self.hits += 1
+            return value
+
+    def get_or_compute(self, version, key, compute, record_stats=True):
+        """
+        returns the cached value, or computes it with compute() and caches it.
+        If another thread is already computing the same value, waits for its
+        result instead of computing it a second time.
+        """
+        with self._lock:
+            entry = self._entries.get((version, key))
+            if entry is not None:
+                self._entries.move_to_end((version, key))
+                self.hits += record_stats
+                return entry[0]
+            future = self._pending.get((version, key))
+            owner = future is None
+            if owner:
+                self.misses += record_stats
+                future = self._pending[(version, key)] = Future()
+            else:
+                self.coalesced += record_stats
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+            self.put(version, key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[(version, key)]
+
+    def put(self, version, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((version, key), None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[(version, key)] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def drop_other_versions(self, version):
+        """
+        removes everything which was not computed from the given version
+        """
+        with self._lock:
+            for k in [k for k in self._entries if k[0] != version]:
+                self.nbytes -= self._entries.pop(k)[1]
+
+
+def drop_other_versions(dataset):
+    """
+    frees the memory of all caches after a new version of the dataset has been loaded
+    """
+    for cache in CACHES:
+        cache.drop_other_versions(dataset.version)
@@ -1,8 +1,7 @@
-from collections import defaultdict
-import operator
-from functools import reduce
-import pandas as pd
+import os
 
+from cache import drop_other_versions
+from dataset import DatasetManager
 from figures import *
 
 
@@ -10,18 +9,39 @@ from figures import *
 # data import #
 ###############
 
-
-def f():
-    return defaultdict(f)
-
-
-DATA = defaultdict(f)
-with pd.HDFStore("./app_dataset.h5") as store:
-    for k in store.keys():
-        p = k.split("/")[1:-1]
-        key = k.split("/")[-1]
-        reduce(operator.getitem, p, DATA)[key] = store[k]
-    PARAM_DF = store["/param_df"]
+# the dataset is reloaded whenever the file changes (see DatasetManager), so
+# always get the data through DATASET.current() instead of keeping a reference
+DATA_PATH = os.environ.get("DATA_PATH", "./app_dataset.h5")
+
+# with FAST_START=1 the server starts before the dataset has been read; the
+# first requests which need data wait until it is there, for up to
+# DATASET_TIMEOUT seconds, and then get a 503 (Heroku gives up on a request
+# after 30 seconds anyway)
+FAST_START = os.environ.get("FAST_START", "0") == "1"
+DATASET_TIMEOUT = float(os.environ.get("DATASET_TIMEOUT", 20))
+
+DATASET = DatasetManager(DATA_PATH, load_timeout=DATASET_TIMEOUT)
+DATASET.subscribe(drop_other_versions)
+if FAST_START:
+    DATASET.watch()
+else:
+    DATASET.load()
+
+# distances between the outputs, made by distances.py; computed when the app first
+# needs them if the file is missing or was made for another version of the dataset
+DISTANCES_PATH = os.environ.get(
+    "DISTANCES_PATH", os.path.splitext(DATA_PATH)[0] + "_distances.npz"
+)
+
+# memory budget for the figures cached in front of the figure callbacks
+FIGURE_CACHE_BYTES = int(os.environ.get("FIGURE_CACHE_MB", 64)) * 2 ** 20
+
+# memory budget for the shards (see shards.py) the figures are put together from
+SHARD_CACHE_BYTES = int(os.environ.get("SHARD_CACHE_MB", 64)) * 2 ** 20
+
+# how often each figure has been requested, used to warm up the figure cache
+# of new workers with the most popular figures first
+WARMUP_STATS_PATH = os.environ.get("WARMUP_STATS_PATH", "./warmup_stats.json")
 
 #############################################################################
 # change text elements of app here (all but descriptions displayed on tabs) #
@@ -0,0 +1,228 @@
+"""
+Loading of the app dataset, and swapping in new versions of it while the app is running
+"""
+import hashlib
+import logging
+import operator
+import os
+import signal
+import threading
+from collections import defaultdict
+from functools import reduce
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# columns of the parameter grid which together select one output
+SCENARIO_COLUMNS = [
+    "n_init_big_firms",
+    "mean_cons_concern",
+    "w_loyal_firm",
+    "scen_number_of_firms",
+    "openness_lower",
+]
+
+
+def f():
+    return defaultdict(f)
+
+
+def plain(tree):
+    """
+    turns nested defaultdicts into plain dicts, so that looking up a missing
+    key raises a KeyError instead of adding it
+    """
+    if isinstance(tree, dict):
+        return {k: plain(v) for k, v in tree.items()}
+    return tree
+
+
+class UnknownOutput(KeyError):
+    """
+    raised for output numbers which are not in the dataset
+    """
+
+
+class DatasetUnavailable(RuntimeError):
+    """
+    raised when no version of the dataset has been loaded in time
+    """
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    returns the sha256 of the file at path, used as the version of the dataset
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Dataset:
+    """
+    One version of the dataset: the model outputs, the parameter grid and an
+    index from parameter combinations to output numbers.
+    Never modified after creation, so it can be shared between threads.
+    """
+
+    def __init__(self, data, param_df, version, stat=None):
+        self.data = data
+        self.param_df = param_df
+        self.version = version
+        self.stat = stat
+        # the first matching row wins, as with PARAM_DF.loc[...].index[0]
+        self.scenario_index = {}
+        self.scenarios = {}
+        for idx, row in zip(param_df.index, param_df[SCENARIO_COLUMNS].itertuples(index=False)):
+            self.scenario_index.setdefault(tuple(row), str(idx))
+            self.scenarios[str(idx)] = tuple(row)
+
+    @classmethod
+    def from_file(cls, path):
+        stat = os.stat(path)
+        version = file_hash(path)
+        data = defaultdict(f)
+        with pd.HDFStore(path, mode="r") as store:
+            for k in store.keys():
+                p = k.split("/")[1:-1]
+                key = k.split("/")[-1]
+                reduce(operator.getitem, p, data)[key] = store[k]
+            param_df = store["/param_df"]
+        return cls(plain(data), param_df, version, (stat.st_mtime, stat.st_size))
+
+    def lookup(self, nbf, pc, l, openness, shock_num):
+        """
+        returns the output number (as a string) for the given scenario parameters
+        """
+        return self.scenario_index[(str(nbf), pc, l, str(shock_num), openness)]
+
+    def scenario(self, idx):
+        """
+        returns the scenario parameters of output number idx, as a dict by column
+        """
+        return dict(zip(SCENARIO_COLUMNS, self.scenarios[idx]))
+
+    def has_output(self, idx):
+        return isinstance(idx, str) and "output_" + idx in self.data
+
+    def output(self, idx):
+        if not self.has_output(idx):
+            raise UnknownOutput("no output {!r} in dataset version {}".format(idx, self.version[:12]))
+        return self.data["output_" + idx]
+
+
+class DatasetManager:
+    """
+    Holds the current version of the dataset and replaces it when the file changes.
+
+    Request handlers should call `current()` once and use the returned dataset
+    for the whole request: a reload swaps in a new object and never touches
+    the old one, so requests in flight finish on the version they started with.
+    """
+
+    def __init__(self, path, poll_interval=5, load_timeout=20):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.load_timeout = load_timeout
+        self._dataset = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+        self._wake = threading.Event()
+        # set once the first load has been tried, whether or not it worked
+        self._tried = threading.Event()
+        self._watcher = None
+        self._listeners = []
+
+    def current(self, timeout=None):
+        """
+        the current version of the dataset. If the first version is still being
+        loaded in the background, waits for it for up to `timeout` seconds
+        (load_timeout by default) and then raises DatasetUnavailable. Once a
+        load has failed, raises it straight away until a load works
+        """
+        dataset = self._dataset
+        if dataset is None:
+            self._tried.wait(self.load_timeout if timeout is None else timeout)
+            dataset = self._dataset
+        if dataset is None:
+            if self._error is not None:
+                raise DatasetUnavailable("could not load {}: {}".format(self.path, self._error))
+            raise DatasetUnavailable("{} is still being loaded".format(self.path))
+        return dataset
+
+    @property
+    def version(self):
+        return self._dataset.version if self._dataset is not None else None
+
+    def subscribe(self, fn):
+        """
+        fn(dataset) is called after every new version has been swapped in
+        """
+        self._listeners.append(fn)
+
+    def load(self):
+        """
+        loads the file and swaps it in, unless it is the version we already have.
+        Returns True if the dataset was replaced.
+        """
+        with self._loading:
+            dataset = Dataset.from_file(self.path)
+            with self._lock:
+                if self._dataset is not None and dataset.version == self._dataset.version:
+                    self._dataset.stat = dataset.stat
+                    return False
+                self._dataset = dataset
+        self._error = None
+        self._tried.set()
+        logger.info("loaded dataset version %s from %s", dataset.version[:12], self.path)
+        for fn in self._listeners:
+            fn(dataset)
+        return True
+
+    def _changed_on_disk(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # keep serving the version we have, but try (and fail) to load a
+            # missing file if there is none, so that the error is reported
+            return self._dataset is None
+        dataset = self._dataset
+        return dataset is None or (stat.st_mtime, stat.st_size) != dataset.stat
+
+    def _watch(self):
+        forced = False
+        while True:
+            if forced or self._changed_on_disk():
+                try:
+                    self.load()
+                except Exception as e:
+                    self._error = "{}: {}".format(type(e).__name__, e)
+                    self._tried.set()
+                    # most likely the file is still being written; keep serving
+                    # the old version and try again on the next poll
+                    logger.exception("could not load %s, keeping version %s", self.path, self.version)
+            forced = self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def watch(self):
+        """
+        starts a background thread which reloads the dataset when the file changes.
+        If nothing has been loaded yet, the thread loads the first version straight away.
+        Threads do not survive a fork, so this has to be called in every worker process.
+        """
+        if self._watcher is None or not self._watcher.is_alive():
+            self._watcher = threading.Thread(target=self._watch, name="dataset-watcher", daemon=True)
+            self._watcher.start()
+
+    def request_reload(self):
+        """
+        asks the watcher thread to reload the file now
+        """
+        self._wake.set()
+
+    def install_signal_handler(self, signum=signal.SIGHUP):
+        signal.signal(signum, lambda *args: self.request_reload())
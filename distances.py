@@ -0,0 +1,182 @@
+"""
+How different the outputs of the model are from each other
+
+    python distances.py
+
+computes a feature vector for every output from the tables shown on the
+tabs, the distances between all pairs of outputs, and saves them next to
+the dataset, so that the app can find the output most different from a
+given one with a single lookup.
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import VersionedCache
+from config import DATASET, DISTANCES_PATH
+
+logger = logging.getLogger(__name__)
+
+
+def output_features(output):
+    """
+    returns a dict of features of one output, grouped by the tab they come
+    from; histograms get one feature per bin
+    """
+    ms = output["market_share_df"]
+    requests = np.bincount(output["data_request_plot_df"].requests.values.astype(int))
+    entry = output["cat_entry_and_exit_df"]
+    spec = output["firm_specialisation_df"]
+    compl = output["complimentarity_df"]
+    innov = output["innovation_df"]
+    quality = output["welfare_df"].quality
+    quality = quality[quality > 0]
+    return {
+        ("market-dominance", "mean"): ms.consumer.mean(),
+        ("market-dominance", "max"): ms.consumer.max(),
+        ("market-dominance", "min"): ms.consumer.min(),
+        **{
+            ("data-sharing", k): v
+            for k, v in enumerate(requests / max(requests.sum(), 1))
+        },
+        ("new-products", "entry"): entry.entry.sum(),
+        ("new-products", "exit"): entry.exit.sum(),
+        ("new-products", "net"): entry.entry.sum() - entry.exit.sum(),
+        **{("firm-specialisation", b): p for b, p in zip(spec.bins, spec.perc)},
+        **{("complimentarity", b): p for b, p in zip(compl.bins, compl.perc)},
+        ("category-innovation", "new"): innov.new.sum(),
+        ("category-innovation", "existing"): innov.existing.sum(),
+        ("consumer-satisfaction", "mean"): quality.mean() if len(quality) else 0,
+        ("consumer-satisfaction", "max"): quality.max() if len(quality) else 0,
+        ("consumer-satisfaction", "categories"): len(quality),
+    }
+
+
+def feature_matrix(dataset):
+    """
+    returns the output numbers and a matrix with one row of features per output.
+    Features are standardised, and every tab has the same weight however many
+    features it has
+    """
+    # only outputs which can be chosen with the inputs of the app
+    reachable = set(dataset.scenario_index.values())
+    outputs = [
+        str(idx)
+        for idx in dataset.param_df.index
+        if str(idx) in reachable and dataset.has_output(str(idx))
+    ]
+    df = pd.DataFrame([output_features(dataset.output(idx)) for idx in outputs]).fillna(0)
+    df = (df - df.mean()) / df.std(ddof=0).replace(0, 1)
+    groups = df.columns.get_level_values(0)
+    df = df / np.sqrt(groups.map(groups.value_counts()).values.astype(float))
+    return outputs, df.values
+
+
+def pairwise_distances(x):
+    """
+    euclidean distances between all rows of x
+    """
+    sq = (x ** 2).sum(axis=1)
+    d = sq[:, None] + sq[None, :] - 2 * x @ x.T
+    return np.sqrt(np.maximum(d, 0))
+
+
+class ScenarioDistances:
+    """
+    Distances between all outputs of one version of the dataset. Only the
+    upper triangle is kept, as float16, plus the most distant output of each.
+    """
+
+    def __init__(self, version, outputs, condensed, farthest):
+        self.version = version
+        self.outputs = np.asarray(outputs)
+        self.condensed = condensed
+        self.farthest = farthest
+        self._position = {o: i for i, o in enumerate(self.outputs)}
+
+    @property
+    def nbytes(self):
+        return self.outputs.nbytes + self.condensed.nbytes + self.farthest.nbytes
+
+    @classmethod
+    def compute(cls, dataset):
+        outputs, x = feature_matrix(dataset)
+        d = pairwise_distances(x)
+        farthest = d.argmax(axis=1).astype(np.int32)
+        condensed = d[np.triu_indices(len(outputs), k=1)].astype(np.float16)
+        return cls(dataset.version, outputs, condensed, farthest)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            version=self.version,
+            outputs=self.outputs,
+            condensed=self.condensed,
+            farthest=self.farthest,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(str(f["version"]), f["outputs"], f["condensed"], f["farthest"])
+
+    @classmethod
+    def for_dataset(cls, path, dataset):
+        """
+        the distances saved at path, or computed now if they are missing or
+        belong to another version of the dataset
+        """
+        try:
+            distances = cls.load(path)
+        except (OSError, KeyError, ValueError):
+            distances = None
+        if distances is None or distances.version != dataset.version:
+            logger.warning("no distances for dataset version %s in %s, computing them", dataset.version[:12], path)
+            distances = cls.compute(dataset)
+        return distances
+
+    def distance(self, a, b):
+        i, j = sorted([self._position[a], self._position[b]])
+        if i == j:
+            return 0.0
+        n = len(self.outputs)
+        return float(self.condensed[i * n - i * (i + 1) // 2 + j - i - 1])
+
+    def most_different(self, idx):
+        """
+        the output which is most different from output idx
+        """
+        return str(self.outputs[self.farthest[self._position[idx]]])
+
+
+# one ScenarioDistances per version of the dataset; they take about
+# (number of outputs)^2 bytes
+DISTANCES = VersionedCache("distances", 16 * 2 ** 20, lambda d: d.nbytes)
+
+
+def scenario_distances(dataset):
+    return DISTANCES.get_or_compute(
+        dataset.version,
+        "distances",
+        lambda: ScenarioDistances.for_dataset(DISTANCES_PATH, dataset),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--out", default=DISTANCES_PATH)
+    args = parser.parse_args()
+    distances = ScenarioDistances.compute(DATASET.current())
+    distances.save(args.out)
+    print(
+        "saved distances between {} outputs to {} ({:,} bytes)".format(
+            len(distances.outputs), args.out, os.path.getsize(args.out)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
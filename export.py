@@ -0,0 +1,396 @@
+"""
+REST API to download the model outputs behind the figures
+
+    /api/export/<table>.<format>?<filters>
+
+table is one of the tables of an output (e.g. market_share_df), or `params`
+for the parameter grid itself. format is csv, parquet or arrow (Arrow IPC
+stream). The filters select outputs by the columns of the parameter grid,
+e.g. `?n_init_big_firms=1&n_init_big_firms=2&openness_lower=high`, or by
+output number with `?output=12&output=13`. Without filters, all outputs are
+exported. The rows of every output are tagged with an `output` column.
+
+The response is written one output at a time, so exporting everything does
+not need it all in memory at once. Files of several outputs are also written
+to a spool directory while they are sent; once complete, they are served from
+there, so every download can be resumed with Range requests.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+import pandas as pd
+from flask import Blueprint, Response, abort, request
+from werkzeug.http import parse_range_header
+
+from cache import VersionedCache
+from config import DATASET
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CACHE_BYTES = int(os.environ.get("EXPORT_CACHE_MB", 64)) * 2 ** 20
+
+# complete files of several outputs, named after their etag; the least
+# recently used are deleted when they take up more than EXPORT_SPOOL_MB
+SPOOL_DIR = os.environ.get(
+    "EXPORT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "odi-app-exports")
+)
+SPOOL_BYTES = int(os.environ.get("EXPORT_SPOOL_MB", 512)) * 2 ** 20
+
+# rows per parquet row group (and arrow record batch); row groups of a single
+# output are tiny and make parquet files many times bigger
+ROW_GROUP_ROWS = 2 ** 16
+
+# spooled files are sent in chunks of this size
+CHUNK_BYTES = 2 ** 20
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# encoded tables of single outputs, keyed by (table, output, format); csv
+# entries have no header line, so they can be joined into bigger exports
+EXPORT_CACHE = VersionedCache("export", EXPORT_CACHE_BYTES, len)
+
+export_api = Blueprint("export", __name__, url_prefix="/api/export")
+
+# spooled files which are still being written after their download was
+# interrupted, by path, with an event which is set once they are done
+_finishing = {}
+_finishing_lock = threading.Lock()
+
+
+class _Sink:
+    """
+    write-only file for pyarrow which hands out what has been written so far,
+    so that the encoded file can be sent while it is being written
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _pyarrow():
+    # pyarrow is big and only needed here, so it is imported on first use
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        abort(501, "pyarrow is not installed, only csv exports are available")
+    return pyarrow
+
+
+def _table(dataset, name, idx):
+    df = dataset.output(idx)[name]
+    return df.assign(output=int(idx))
+
+
+def _csv_rows(dataset, name, idx):
+    def encode():
+        return _table(dataset, name, idx).to_csv(index=False, header=False).encode("utf-8")
+
+    return EXPORT_CACHE.get_or_compute(dataset.version, (name, idx, "csv"), encode)
+
+
+def _csv_header(dataset, name, idx):
+    return _table(dataset, name, idx).head(0).to_csv(index=False).encode("utf-8")
+
+
+def _batches(frames):
+    """
+    joins consecutive frames until they have at least ROW_GROUP_ROWS rows
+    """
+    batch, rows = [], 0
+    for df in frames:
+        batch.append(df)
+        rows += len(df)
+        if rows >= ROW_GROUP_ROWS:
+            yield pd.concat(batch, ignore_index=True)
+            batch, rows = [], 0
+    if batch:
+        yield pd.concat(batch, ignore_index=True)
+
+
+def _encode_arrow(frames, fmt):
+    """
+    yields the arrow or parquet encoding of the frames, one batch of frames at a time
+    """
+    pa = _pyarrow()
+    sink = _Sink()
+    writer = None
+    for df in _batches(frames):
+        if writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            schema = table.schema
+            if fmt == "parquet":
+                writer = pa.parquet.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+            else:
+                writer = pa.RecordBatchStreamWriter(pa.PythonFile(sink, mode="w"), schema)
+        else:
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+def _blob(dataset, name, idx, fmt):
+    """
+    the complete file for the table of a single output
+    """
+    if fmt == "csv":
+        return _csv_header(dataset, name, idx) + _csv_rows(dataset, name, idx)
+    return EXPORT_CACHE.get_or_compute(
+        dataset.version,
+        (name, idx, fmt),
+        lambda: b"".join(_encode_arrow([_table(dataset, name, idx)], fmt)),
+    )
+
+
+def _encode(dataset, name, outputs, fmt):
+    """
+    yields the file for the table of several outputs, in pieces as it is encoded
+    """
+    if fmt == "csv":
+        yield _csv_header(dataset, name, outputs[0])
+        # not cached: a big export would push everything else out of the cache
+        for idx in outputs:
+            yield _table(dataset, name, idx).to_csv(index=False, header=False).encode("utf-8")
+    else:
+        yield from _encode_arrow((_table(dataset, name, idx) for idx in outputs), fmt)
+
+
+def _prune_spool():
+    files = []
+    for entry in os.scandir(SPOOL_DIR):
+        if not entry.name.endswith(".part"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= SPOOL_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _write_rest(pieces, fh, tmp, path):
+    """
+    writes the remaining pieces to fh, the open file tmp, and moves it to path
+    """
+    try:
+        with fh:
+            for piece in pieces:
+                fh.write(piece)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _prune_spool()
+
+
+def _finish(pieces, fh, tmp, path, done):
+    try:
+        _write_rest(pieces, fh, tmp, path)
+    except Exception:
+        logger.exception("could not finish %s", path)
+    finally:
+        with _finishing_lock:
+            if _finishing.get(path) is done:
+                del _finishing[path]
+        done.set()
+
+
+def _spool(pieces, path):
+    """
+    yields the pieces and writes them to path, which only appears once they
+    have all been written. If the download is interrupted, the rest is written
+    in the background, so that resuming it does not start from scratch
+    """
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=SPOOL_DIR, suffix=".part")
+    fh = os.fdopen(fd, "wb")
+    try:
+        for piece in pieces:
+            fh.write(piece)
+            yield piece
+    except GeneratorExit:
+        done = threading.Event()
+        with _finishing_lock:
+            _finishing[path] = done
+        threading.Thread(
+            target=_finish, args=(pieces, fh, tmp, path, done), name="export-spool", daemon=True
+        ).start()
+        raise
+    except BaseException:
+        fh.close()
+        os.remove(tmp)
+        raise
+    _write_rest((), fh, tmp, path)
+
+
+def _select_outputs(dataset):
+    param_df = dataset.param_df
+    mask = pd.Series(True, index=param_df.index)
+    for column, values in request.args.lists():
+        if column == "output":
+            mask &= param_df.index.astype(str).isin(values)
+        elif column in param_df.columns:
+            mask &= param_df[column].astype(str).isin(values)
+        else:
+            abort(400, "unknown filter {}".format(column))
+    return [
+        str(idx) for idx in param_df.index[mask] if dataset.has_output(str(idx))
+    ]
+
+
+def _slice(parts, start, stop):
+    """
+    yields bytes start to stop (exclusive) of the concatenation of parts,
+    a list of (size, function returning the bytes)
+    """
+    offset = 0
+    for size, get in parts:
+        if offset + size > start and offset < stop:
+            data = get()
+            yield data[max(start - offset, 0):stop - offset]
+        offset += size
+        if offset >= stop:
+            break
+
+
+def _headers(filename, etag):
+    return {
+        "Accept-Ranges": "bytes",
+        "ETag": '"{}"'.format(etag),
+        "Content-Disposition": "attachment; filename={}".format(filename),
+    }
+
+
+def _send_file(path, fmt, filename, etag):
+    # marks the file as recently used, and raises FileNotFoundError if it is not there
+    os.utime(path)
+    # the file stays readable while it is being sent, even if it is pruned meanwhile
+    fh = open(path, "rb")
+    size = os.fstat(fh.fileno()).st_size
+
+    def read(offset):
+        fh.seek(offset)
+        return fh.read(CHUNK_BYTES)
+
+    parts = [
+        (min(CHUNK_BYTES, size - offset), lambda offset=offset: read(offset))
+        for offset in range(0, size, CHUNK_BYTES)
+    ]
+    response = _send(parts, fmt, filename, etag)
+    response.call_on_close(fh.close)
+    return response
+
+
+def _send(parts, fmt, filename, etag):
+    """
+    response with the concatenation of parts, honouring a Range header
+    """
+    total = sum(size for size, _ in parts)
+    headers = _headers(filename, etag)
+    ranges = parse_range_header(request.headers.get("Range"))
+    if_range = request.headers.get("If-Range")
+    if ranges is not None and (if_range is None or if_range.strip('"') == etag):
+        if ranges.units != "bytes" or len(ranges.ranges) != 1:
+            abort(416)
+        span = ranges.range_for_length(total)
+        if span is None:
+            return Response(status=416, headers={"Content-Range": "bytes */{}".format(total)})
+        start, stop = span
+        headers["Content-Range"] = "bytes {}-{}/{}".format(start, stop - 1, total)
+        headers["Content-Length"] = str(stop - start)
+        return Response(_slice(parts, start, stop), 206, headers, mimetype=MIMETYPES[fmt])
+    headers["Content-Length"] = str(total)
+    return Response(_slice(parts, 0, total), 200, headers, mimetype=MIMETYPES[fmt])
+
+
+@export_api.route("/<name>.<fmt>")
+def export(name, fmt):
+    if fmt not in MIMETYPES:
+        abort(404)
+    # one version for the whole download, even if a new one is loaded meanwhile
+    dataset = DATASET.current()
+    outputs = _select_outputs(dataset)
+    filename = "{}.{}".format(name, fmt)
+    etag = hashlib.sha1(
+        "{} {} {} {}".format(dataset.version, name, fmt, ",".join(outputs)).encode("utf-8")
+    ).hexdigest()
+
+    if name == "params":
+        param_df = dataset.param_df
+        param_df = param_df[param_df.index.astype(str).isin(outputs)]
+        param_df = param_df.rename_axis("output").reset_index()
+        if fmt == "csv":
+            blob = param_df.to_csv(index=False).encode("utf-8")
+        else:
+            blob = b"".join(_encode_arrow([param_df], fmt))
+        return _send([(len(blob), lambda: blob)], fmt, filename, etag)
+
+    if not outputs:
+        abort(404, "no outputs match the filters")
+    if name not in dataset.output(outputs[0]):
+        abort(404, "unknown table {}".format(name))
+
+    if len(outputs) == 1:
+        blob = _blob(dataset, name, outputs[0], fmt)
+        return _send([(len(blob), lambda: blob)], fmt, filename, etag)
+
+    if fmt != "csv":
+        _pyarrow()
+    path = os.path.join(SPOOL_DIR, "{}.{}".format(etag, fmt))
+    with _finishing_lock:
+        done = _finishing.get(path)
+    if done is not None:
+        # an interrupted download of the same file which is still being written
+        done.wait()
+    try:
+        return _send_file(path, fmt, filename, etag)
+    except FileNotFoundError:
+        pass
+    pieces = _spool(_encode(dataset, name, outputs, fmt), path)
+    if request.headers.get("Range") is None:
+        # sent as it is encoded, so without a length; a resumed download
+        # gets its range from the spooled file
+        return Response(pieces, 200, _headers(filename, etag), mimetype=MIMETYPES[fmt])
+    for _ in pieces:
+        pass
+    return _send_file(path, fmt, filename, etag)
@@ -0,0 +1,59 @@
+"""
+gunicorn settings for running the app in production
+
+Start with `gunicorn -c gunicorn_config.py odi-app:server`.
+"""
+import gc
+import importlib
+import multiprocessing
+import os
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "8050")
+
+# the app (and with it the dataset in config.py) is imported once in the master,
+# so that the workers start out sharing its pages of memory after forking (they
+# get their own copy of every page they write to, see the README). With
+# FAST_START each worker reads the dataset itself in the background instead
+preload_app = os.environ.get("FAST_START", "0") != "1"
+
+# building the figures is CPU bound, so we want roughly one process per core.
+# Heroku sets WEB_CONCURRENCY to a sensible value for the dyno size
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() + 1))
+
+# a couple of threads per worker stop slow clients from blocking a process,
+# without green threads fighting over the CPU
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 2))
+
+timeout = 120
+keepalive = 5
+loglevel = os.environ.get("LOG_LEVEL", "info")
+accesslog = "-"
+
+
+def pre_fork(server, worker):
+    # move everything allocated so far (mostly the dataset) out of the reach of
+    # the garbage collector, otherwise its bookkeeping writes to those pages
+    # and defeats copy-on-write sharing (only available from python 3.7, so not
+    # in the Docker image)
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # watch app_dataset.h5 and swap in new versions without a restart. Each
+    # worker loads its own copy of a new version, so until the next restart the
+    # dataset is no longer shared between workers
+    import config
+
+    config.DATASET.watch()
+    # fill the figure cache of the new worker in the background
+    importlib.import_module("odi-app").WARMUP.start()
+
+
+def post_worker_init(worker):
+    # `kill -HUP <worker pid>` reloads the dataset right away (sending HUP to
+    # the master restarts the workers instead)
+    import config
+
+    config.DATASET.install_signal_handler()
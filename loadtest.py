@@ -0,0 +1,266 @@
+"""
+Load test for a running instance of the app
+
+Simulates users clicking through the app: every session picks random
+scenarios from the parameter grid and clicks "Apply parameters", sending the
+same `_dash-update-component` requests as the browser does, then looks at the
+figures for a while. Switching tabs and toggling the privacy shock happen in
+the browser and don't send requests. At the end it reports latency
+percentiles and errors per callback.
+
+Only uses the standard library (and pandas to read the parameter grid), and
+only talks to the given url, e.g.
+
+    python loadtest.py --url http://127.0.0.1:8050 --users 8 --duration 60
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+import pandas as pd
+
+# mirrors TAB_DICT in config.py; not imported from there so that the load test
+# does not have to load the whole dataset
+TABS = [
+    "market-dominance",
+    "data-sharing",
+    "new-products",
+    "firm-specialisation",
+    "complimentarity",
+    "category-innovation",
+    "consumer-satisfaction",
+]
+
+STORE_STATES = [
+    ("-num-big-firms", "value"),
+    ("-privacy-concern", "value"),
+    ("-loyalty", "value"),
+    ("-openness", "value"),
+    ("-shock-num", "value"),
+    ("-privacy-onoff", "values"),
+]
+
+
+def read_param_df(path):
+    return pd.read_hdf(path, "param_df")
+
+
+def scenario_from_row(row):
+    """
+    translate a row of the parameter grid into the values of the input widgets
+    """
+    nbf = row.n_init_big_firms
+    shock = row.scen_number_of_firms
+    return {
+        "-num-big-firms": int(nbf) if nbf.isdigit() else nbf,
+        "-privacy-concern": row.mean_cons_concern,
+        "-loyalty": row.w_loyal_firm,
+        "-openness": row.openness_lower,
+        "-shock-num": int(shock) if shock != "0" else 1,
+        "-privacy-onoff": [True] if shock != "0" else [],
+    }
+
+
+def store_payload(tab, i, n_clicks, scenario, current=None):
+    scen = "scen" + str(i)
+    return {
+        "output": tab + "-store-" + str(i) + ".data",
+        "inputs": [{"id": "apply-button", "property": "n_clicks", "value": n_clicks}],
+        "state": [
+            {"id": scen + suffix, "property": prop, "value": scenario[suffix]}
+            for suffix, prop in STORE_STATES
+        ]
+        + [{"id": tab + "-store-" + str(i), "property": "data", "value": current}],
+    }
+
+
+def figure_payload(tab, st1, st2):
+    return {
+        "output": tab + "-graph.figure",
+        "inputs": [
+            {"id": tab + "-store-1", "property": "data", "value": st1},
+            {"id": tab + "-store-2", "property": "data", "value": st2},
+        ],
+    }
+
+
+class Stats:
+    """
+    thread safe collection of latencies and errors per callback output
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.think_times = []
+
+    def add(self, output, latency, ok):
+        with self.lock:
+            self.latencies[output].append(latency)
+            if not ok:
+                self.errors[output] += 1
+
+    def add_think_time(self, t):
+        with self.lock:
+            self.think_times.append(t)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[k]
+
+
+class Session:
+    """
+    one simulated user
+    """
+
+    def __init__(self, url, param_df, stats, think_time, rng):
+        self.endpoint = url.rstrip("/") + "/_dash-update-component"
+        self.param_df = param_df
+        self.stats = stats
+        self.think_time = think_time
+        self.rng = rng
+        self.n_clicks = 0
+        self.stores = {}
+
+    def post(self, payload, expected=(200,)):
+        data = json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(
+            self.endpoint, data=data, headers={"Content-Type": "application/json"}
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                body = response.read()
+            status = response.status
+        except urllib.error.HTTPError as e:
+            body = None
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            body = None
+            status = None
+        self.stats.add(payload["output"], time.perf_counter() - start, status in expected)
+        return json.loads(body.decode("utf-8")) if status == 200 else None
+
+    def think(self):
+        t = self.rng.expovariate(1 / self.think_time) if self.think_time else 0
+        self.stats.add_think_time(t)
+        time.sleep(t)
+
+    def apply(self):
+        scenarios = {
+            i: scenario_from_row(self.param_df.iloc[self.rng.randrange(len(self.param_df))])
+            for i in [1, 2]
+        }
+        changed = set()
+        for i in [1, 2]:
+            for tab in TABS:
+                # the app answers 204 (no update) when the store already holds this output
+                res = self.post(
+                    store_payload(tab, i, self.n_clicks, scenarios[i], self.stores.get((tab, i))),
+                    expected=(200, 204),
+                )
+                if res is not None:
+                    self.stores[(tab, i)] = res["response"]["props"]["data"]
+                    changed.add(tab)
+        for tab in TABS:
+            if tab in changed and (tab, 1) in self.stores and (tab, 2) in self.stores:
+                self.post(figure_payload(tab, self.stores[(tab, 1)], self.stores[(tab, 2)]))
+        self.n_clicks += 1
+
+    def run(self, deadline):
+        # page load fires every callback once with the initial values
+        self.apply()
+        while time.time() < deadline:
+            # looking at a few tabs
+            for _ in range(self.rng.randint(1, 3)):
+                self.think()
+            self.apply()
+
+
+def report(stats, elapsed):
+    rows = []
+    for output in sorted(stats.latencies):
+        lat = stats.latencies[output]
+        rows.append(
+            (
+                output,
+                len(lat),
+                stats.errors[output],
+                percentile(lat, 50) * 1000,
+                percentile(lat, 95) * 1000,
+                percentile(lat, 99) * 1000,
+            )
+        )
+    width = max([len(r[0]) for r in rows] + [len("callback")])
+    print(
+        "{:<{w}} {:>8} {:>7} {:>9} {:>9} {:>9}".format(
+            "callback", "requests", "errors", "p50 ms", "p95 ms", "p99 ms", w=width
+        )
+    )
+    for r in rows:
+        print("{:<{w}} {:>8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f}".format(*r, w=width))
+    total = sum(r[1] for r in rows)
+    all_lat = [x for lat in stats.latencies.values() for x in lat]
+    print()
+    print("total requests: {}, errors: {}".format(total, sum(stats.errors.values())))
+    print("throughput: {:.1f} requests/s".format(total / elapsed))
+    if all_lat:
+        print(
+            "overall latency p50/p95/p99: {:.1f} / {:.1f} / {:.1f} ms".format(
+                percentile(all_lat, 50) * 1000,
+                percentile(all_lat, 95) * 1000,
+                percentile(all_lat, 99) * 1000,
+            )
+        )
+    if stats.think_times:
+        print(
+            "think time: {} pauses, mean {:.2f} s".format(
+                len(stats.think_times), sum(stats.think_times) / len(stats.think_times)
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--data", default="./app_dataset.h5", help="dataset with the parameter grid")
+    parser.add_argument("--users", type=int, default=4, help="number of concurrent sessions")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run for")
+    parser.add_argument(
+        "--think-time", type=float, default=2, help="mean pause between user actions in seconds (0 for none)"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    param_df = read_param_df(args.data)
+    stats = Stats()
+    seed_rng = random.Random(args.seed)
+    deadline = time.time() + args.duration
+    threads = [
+        threading.Thread(
+            target=Session(
+                args.url, param_df, stats, args.think_time, random.Random(seed_rng.random())
+            ).run,
+            args=(deadline,),
+        )
+        for _ in range(args.users)
+    ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report(stats, time.time() - start)
+
+
+if __name__ == "__main__":
+    main()
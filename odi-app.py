@@ -1,8 +1,13 @@
+import json
 import os
 
 import dash
+import flask
+import numpy as np
+import plotly
 
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from dash_html_components import Div, Span, Img, P, Button, Details, Summary, A
 from dash_core_components import (
     RadioItems,
@@ -15,9 +20,19 @@ from dash_core_components import (
 )
 import dash_bootstrap_components as dbc
 
+from admin import admin_api, PROFILER
+from cache import VersionedCache
+from dataset import DatasetUnavailable
+from distances import scenario_distances
+from export import export_api
+from shards import combine, figure_shard
+from warmup import AccessStats, WarmupScheduler
 from config import (
     TAB_DICT,
-    DATA,
+    DATASET,
+    FIGURE_CACHE_BYTES,
+    SHARD_CACHE_BYTES,
+    WARMUP_STATS_PATH,
     TOOLTIP_STYLE,
     HOVERTEXTS,
     ITEM_BOTTOM,
@@ -25,7 +40,6 @@ from config import (
     DISCLAIMER,
     ABLED_STYLE_RADIO,
     DISABLED_STYLE_RADIO,
-    PARAM_DF
 )
 
 
@@ -37,8 +51,60 @@ external_stylesheets = [
     dbc.themes.BOOTSTRAP,
 ]
 
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+class Dash(dash.Dash):
+    """
+    Dash app which serialises its (static) layout once, instead of on every page load
+    """
+
+    _layout_json = None
+
+    def serve_layout(self):
+        if self._layout_json is None:
+            self._layout_json = json.dumps(
+                self._layout_value(), cls=plotly.utils.PlotlyJSONEncoder
+            )
+        return flask.Response(self._layout_json, mimetype="application/json")
+
+    def dispatch(self):
+        # does nothing unless profiling has been started with /admin/profile
+        with PROFILER.callback():
+            return super().dispatch()
+
+
+app = Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server
+server.register_blueprint(export_api)
+server.register_blueprint(admin_api)
+
+
+@server.errorhandler(DatasetUnavailable)
+def dataset_unavailable(e):
+    # with FAST_START, for requests which come before the dataset has been loaded
+    return flask.Response(str(e), status=503, mimetype="text/plain", headers={"Retry-After": "10"})
+
+def shock_num_input(scen_name, value=1, enabled=False, key=None):
+    """
+    The number of companies hit by a privacy shock, greyed out and disabled
+    unless the shock is on. In the browser, assets/shock-toggle.js takes care
+    of this when the shock is switched on or off.
+    """
+    style = ABLED_STYLE_RADIO if enabled else DISABLED_STYLE_RADIO
+    return Div(
+        RadioItems(
+            id=scen_name + "-shock-num",
+            options=[
+                {"label": x, "value": x, "disabled": not enabled} for x in [1, 2, 3, 4]
+            ],
+            labelStyle=dict(style, **{"padding-bottom": ITEM_BOTTOM}),
+            inputStyle={"margin-right": "10px"},
+            value=value,
+            style={"margin-bottom": "4%"},
+        ),
+        # a new key makes React render the input from scratch, dropping the
+        # changes shock-toggle.js made to it
+        key=key,
+    )
+
 
 def scenario_input_card(scen_name):
     """
@@ -191,18 +257,7 @@ def scenario_input_card(scen_name):
                 inputStyle={"margin-right": "5px"},
                 style={"margin-bottom": "2%", "margin-top": "0%"},
             ),
-            RadioItems(
-                id=scen_name + "-shock-num",
-                options=[{"label": x, "value": x} for x in [1, 2, 3, 4]],
-                labelStyle={
-                    "display": "inline-block",
-                    "margin-right": "15px",
-                    "padding-bottom": ITEM_BOTTOM,
-                },
-                inputStyle={"margin-right": "10px"},
-                value=1,
-                style={"margin-bottom": "4%"},
-            ),
+            Div(shock_num_input(scen_name), id=scen_name + "-shock-num-container"),
         ],
         className="scenario-input",
         style={"background-color": "rgb(234, 234, 234)", "font-size": "16px"},
@@ -213,6 +268,16 @@ def scenario_input_card(scen_name):
 app.layout = Div(
     [
         Div([Store(x + "-store-" + str(i)) for x in TAB_DICT.keys() for i in [1, 2]]),
+        # styles of the number of firms hit by a privacy shock, for when the
+        # shock is on and off, used by assets/shock-toggle.js
+        Div(
+            id="shock-styles",
+            style={"display": "none"},
+            **{
+                "data-enabled-style": json.dumps(ABLED_STYLE_RADIO),
+                "data-disabled-style": json.dumps(DISABLED_STYLE_RADIO),
+            }
+        ),
         # header
         Div(
             Div(
@@ -267,6 +332,24 @@ app.layout = Div(
                             scenario_input_card("scen1"),
                             Div("Scenario 2", className="scenario-name"),
                             scenario_input_card("scen2"),
+                            Div(
+                                [
+                                    Button(
+                                        "Most different from scenario 1",
+                                        n_clicks=0,
+                                        id="most-different-button",
+                                        style={
+                                            "margin": "5px 0",
+                                            "border-radius": "25.5px",
+                                            "border": "1px solid #000000",
+                                        },
+                                    ),
+                                    Div(
+                                        id="most-different-note",
+                                        style={"font-size": "12px"},
+                                    ),
+                                ]
+                            ),
                             Div(
                                 Button(
                                     "Apply parameters >",
@@ -304,10 +387,22 @@ app.layout = Div(
                                 ),
                                 className="row",
                             ),
+                            # the tabs show their content in the browser, without
+                            # asking the server
                             Tabs(
                                 id="tab",
                                 children=[
                                     Tab(
+                                        Div(
+                                            children=[
+                                                P(
+                                                    y["text"],
+                                                    style={"margin": "20px", "font-size": "13px"},
+                                                ),
+                                                Graph(id=x + "-graph"),
+                                            ],
+                                            style={"border": "1px solid #d6d6d6"},
+                                        ),
                                         label=y["label"],
                                         value=x,
                                         className="custom-tab",
@@ -322,25 +417,6 @@ app.layout = Div(
                                     "primary": "#1975FA",
                                 },
                             ),
-                            Div(
-                                children=[
-                                    P(
-                                        id="tab-text",
-                                        style={"margin": "20px", "font-size": "13px"},
-                                    )
-                                ]
-                                + [
-                                    Div(
-                                        Graph(
-                                            id=x + "-graph"
-                                        ),
-                                        id=x + "-graph-div",
-                                        style={"display": "none"}
-                                    )
-                                    for x in TAB_DICT.keys()
-                                ],
-                                style={"border": "1px solid #d6d6d6"},
-                            ),
                         ],
                         className="nine columns",
                         style={
@@ -360,73 +436,34 @@ app.layout = Div(
 )
 
 
-# callbacks for styling
-@app.callback(
-    Output("scen1-shock-num", "labelStyle"), [Input("scen1-privacy-onoff", "values")]
-)
-def decolour_input_1(vals):
-    return ABLED_STYLE_RADIO if (True in vals) else DISABLED_STYLE_RADIO
-
-
-@app.callback(
-    Output("scen2-shock-num", "labelStyle"), [Input("scen2-privacy-onoff", "values")]
-)
-def decolour_input_2(vals):
-    return ABLED_STYLE_RADIO if (True in vals) else DISABLED_STYLE_RADIO
-
-
-@app.callback(
-    Output("scen1-shock-num", "options"),
-    [Input("scen1-privacy-onoff", "values")],
-    [State("scen1-shock-num", "options")],
-)
-def disable_input_1(vals, opts):
-    return [
-        {"label": opt["label"], "value": opt["value"], "disabled": (vals == [])}
-        for opt in opts
-    ]
-
-
-@app.callback(
-    Output("scen2-shock-num", "options"),
-    [Input("scen2-privacy-onoff", "values")],
-    [State("scen2-shock-num", "options")],
-)
-def disable_input_2(vals, opts):
-    return [
-        {"label": opt["label"], "value": opt["value"], "disabled": (vals == [])}
-        for opt in opts
-    ]
+# whenever user clicks the 'apply scenarios button' we update two stores which
+# have the version of the dataset and the index of the output to use, as
+# "<version>:<index>"
+def store_value(dataset, idx):
+    return dataset.version + ":" + idx
 
 
-# changing the info text displayed above each figure
-@app.callback(Output("tab-text", "children"), [Input("tab", "value")])
-def tab_text(val):
-    return TAB_DICT[val]["text"]
+def store_output(dataset, value):
+    """
+    the output number in a store value, or None if the value was not made
+    from this version of the dataset
+    """
+    if not isinstance(value, str):
+        return None
+    version, _, idx = value.rpartition(":")
+    return idx if version == dataset.version else None
 
 
-# whenever user clicks the 'apply scenarios button' we update two stores which
-# have the index of the output to use as a string
 def update_store_fn(i, x):
-    # store just holds a string with the right output number
-    def callback(n_click, nbf, pc, l, openness, shock_num, p_onoff):
-        if True in p_onoff:
-            idx = PARAM_DF.loc[
-                (PARAM_DF.n_init_big_firms == str(nbf))
-                & (PARAM_DF.mean_cons_concern == pc)
-                & (PARAM_DF.w_loyal_firm == l)
-                & (PARAM_DF.scen_number_of_firms == str(shock_num))
-                & (PARAM_DF.openness_lower == openness)
-            ].index[0]
-        else:
-            idx = PARAM_DF.loc[
-                (PARAM_DF.n_init_big_firms == str(nbf))
-                & (PARAM_DF.mean_cons_concern == pc)
-                & (PARAM_DF.w_loyal_firm == l)
-                & (PARAM_DF.scen_number_of_firms == str(0))
-                & (PARAM_DF.openness_lower == openness)
-            ].index[0]
-        return str(idx)
+    def callback(n_click, nbf, pc, l, openness, shock_num, p_onoff, current):
+        if True not in p_onoff:
+            shock_num = 0
+        dataset = DATASET.current()
+        value = store_value(dataset, dataset.lookup(nbf, pc, l, openness, shock_num))
+        if value == current:
+            # same output of the same dataset version, so don't redraw the figure
+            raise PreventUpdate
+        return value
 
     return callback
 
@@ -446,26 +483,141 @@ for i in [1, 2]:
                     "-shock-num",
                 ]
             ]
-            + [State("scen" + str(i) + "-privacy-onoff", "values")],
+            + [
+                State("scen" + str(i) + "-privacy-onoff", "values"),
+                State(x + "-store-" + str(i), "data"),
+            ],
         )(update_store_fn(i, x))
 
 
-# after clicking apply button, all figures are updated with the correct data
-def update_figure(x):
-    def callback(st1, st2):
-        print(st1, st2)
-        return TAB_DICT[x]["figure"](
-            DATA["output_" + st1][TAB_DICT[x]["store"]],
-            DATA["output_" + st2][TAB_DICT[x]["store"]],
-        )
+# sets scenario 2 to the output which differs most from scenario 1, by the
+# distances computed in distances.py
+@app.callback(
+    [
+        Output("scen2" + y, prop)
+        for y, prop in [
+            ("-num-big-firms", "value"),
+            ("-privacy-concern", "value"),
+            ("-loyalty", "value"),
+            ("-openness", "value"),
+            ("-privacy-onoff", "values"),
+            ("-shock-num-container", "children"),
+        ]
+    ]
+    + [Output("most-different-note", "children")],
+    [Input("most-different-button", "n_clicks")],
+    [
+        State("scen1" + y, "value")
+        for y in [
+            "-num-big-firms",
+            "-privacy-concern",
+            "-loyalty",
+            "-openness",
+            "-shock-num",
+        ]
+    ]
+    + [State("scen1-privacy-onoff", "values")],
+)
+def most_different(n_clicks, nbf, pc, l, openness, shock_num, p_onoff):
+    if not n_clicks:
+        raise PreventUpdate
+    if True not in p_onoff:
+        shock_num = 0
+    dataset = DATASET.current()
+    idx = dataset.lookup(nbf, pc, l, openness, shock_num)
+    scen = dataset.scenario(scenario_distances(dataset).most_different(idx))
+    nbf = scen["n_init_big_firms"]
+    shock = scen["scen_number_of_firms"]
+    return (
+        int(nbf) if nbf.isdigit() else nbf,
+        scen["mean_cons_concern"],
+        scen["w_loyal_firm"],
+        scen["openness_lower"],
+        [True] if shock != "0" else [],
+        shock_num_input(
+            "scen2",
+            value=int(shock) if shock != "0" else 1,
+            enabled=shock != "0",
+            key=str(n_clicks),
+        ),
+        "Scenario 2 is now the scenario most different from scenario 1. "
+        "Click “Apply parameters” to compare them.",
+    )
+
+
+def json_size(obj):
+    """
+    rough size of obj as json, without encoding it: a few bytes per number
+    and the length of the strings
+    """
+    if isinstance(obj, dict):
+        return sum(len(k) + 4 + json_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(json_size(v) + 1 for v in obj) + 2
+    if isinstance(obj, np.ndarray):
+        return obj.size * (8 if obj.dtype.kind in "biuf" else 16)
+    if isinstance(obj, str):
+        return len(obj) + 2
+    return 8
+
+
+FIGURE_CACHE = VersionedCache("figures", FIGURE_CACHE_BYTES, json_size)
+
+SHARD_CACHE = VersionedCache("shards", SHARD_CACHE_BYTES, json_size)
+
+
+def get_shard(dataset, x, idx):
+    return SHARD_CACHE.get_or_compute(
+        dataset.version,
+        (x, idx),
+        lambda: figure_shard(TAB_DICT[x]["figure"], dataset.output(idx)[TAB_DICT[x]["store"]]),
+    )
 
-    return callback
 
+def build_figure(dataset, key):
+    # every output is only drawn once per tab, and the figure is put together
+    # from the shards of the two outputs; if they are the same output, its
+    # shard is used for both scenarios
+    x, st1, st2 = key
+    shard1 = get_shard(dataset, x, st1)
+    shard2 = shard1 if st2 == st1 else get_shard(dataset, x, st2)
+    return combine(TAB_DICT[x]["figure"], shard1, shard2)
 
-# when user clicks a tab, only make visible the relevant figure
-def hidden_status_graph(x):
-    def callback(tabname):
-        return {"display": "block"} if tabname == x else {"display": "none"}
+
+def get_figure(dataset, key, record_stats=True):
+    # concurrent requests for the same figure wait for one build instead of
+    # building it several times
+    return FIGURE_CACHE.get_or_compute(
+        dataset.version, key, lambda: build_figure(dataset, key), record_stats
+    )
+
+
+ACCESS_STATS = AccessStats(WARMUP_STATS_PATH)
+WARMUP = WarmupScheduler(
+    DATASET,
+    ACCESS_STATS,
+    FIGURE_CACHE,
+    lambda dataset, key: get_figure(dataset, key, record_stats=False),
+)
+# warm-up waits while any request is being served
+server.wsgi_app = WARMUP.wsgi_middleware(server.wsgi_app)
+
+
+# after clicking apply button, all figures are updated with the correct data
+def update_figure(x):
+    def callback(st1, st2):
+        dataset = DATASET.current()
+        st1, st2 = store_output(dataset, st1), store_output(dataset, st2)
+        # the stores are empty before the first click, and anything can be
+        # posted. If the dataset has been reloaded since the stores were set,
+        # their output numbers may mean other scenarios now; the next click
+        # sets them again from the new version
+        if not all(st in dataset.scenarios and dataset.has_output(st) for st in [st1, st2]):
+            raise PreventUpdate
+        figure = get_figure(dataset, (x, st1, st2))
+        # only figures which could be built are worth warming up
+        ACCESS_STATS.record((x, st1, st2))
+        return figure
 
     return callback
 
@@ -475,11 +627,12 @@ for x in TAB_DICT.keys():
         Output(x + "-graph", "figure"),
         [Input(x + "-store-1", "data"), Input(x + "-store-2", "data")],
     )(update_figure(x))
-    app.callback(Output(x + "-graph-div", "style"), [Input("tab", "value")])(
-        hidden_status_graph(x)
-    )
 
 
 if __name__ == "__main__":
+    DATASET.watch()
+    DATASET.install_signal_handler()
+    WARMUP.start()
     port = int(os.environ.get("PORT", 8050))
-    app.run_server(host='0.0.0.0', port=port, debug=True)
+    debug = os.environ.get("DASH_DEBUG", "1") == "1"
+    app.run_server(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,124 @@
+"""
+Figures put together from one part per output
+
+Every figure in figures.py draws each scenario with its own traces. Rendered
+with the same output as both scenarios, a figure therefore holds everything
+needed to show that output as scenario 1 and as scenario 2: its shard. The
+figure for two outputs is made of the scenario 1 traces of the first shard and
+the scenario 2 traces of the second, without drawing anything again. The app
+does this in `combine`, the static build in static_site/app.js.
+"""
+import copy
+
+from figures import (
+    GREY,
+    scen_colours,
+    dark_scen_colours,
+    plot_market_entry,
+    plot_quality_difference,
+)
+
+# the scenario a trace belongs to, by its colour
+SIDES = {
+    scen_colours[0]: 1,
+    dark_scen_colours[0]: 1,
+    scen_colours[1]: 2,
+    dark_scen_colours[1]: 2,
+}
+
+
+def entry_limits(df):
+    return {"limits": [-float(df.exit.max()) - 0.3, float(df.entry.max()) + 0.3]}
+
+
+def quality_points(df):
+    return {
+        "category": df.category.tolist(),
+        "quality": [None if q != q else float(q) for q in df.quality],
+    }
+
+
+def combine_entry_limits(layout, extra1, extra2):
+    """
+    both plots of the market entry figure share the range of their x axis
+    """
+    limits = [
+        min(extra1["limits"][0], extra2["limits"][0]),
+        max(extra1["limits"][1], extra2["limits"][1]),
+    ]
+    layout["xaxis"]["range"] = limits
+    layout["xaxis2"]["range"] = limits
+    return []
+
+
+def combine_quality_lines(layout, extra1, extra2):
+    """
+    lines between the qualities of the categories offered in both scenarios
+    """
+    quality2 = dict(zip(extra2["category"], extra2["quality"]))
+    return [
+        {
+            "type": "scatter",
+            "x": ["Scenario 1", "Scenario 2"],
+            "y": [q1, quality2.get(c)],
+            "mode": "lines",
+            "showlegend": False,
+            "line": {"color": GREY},
+            "hoverinfo": "skip",
+        }
+        for c, q1 in zip(extra1["category"], extra1["quality"])
+        if q1 and quality2.get(c)
+    ]
+
+
+# figures in which the two scenarios depend on each other: the name of the
+# function in static_site/app.js which combines them, what it needs to know
+# about each output, and the function which combines them here
+COMBINE = {
+    plot_market_entry: ("entry-limits", entry_limits, combine_entry_limits),
+    plot_quality_difference: ("quality-lines", quality_points, combine_quality_lines),
+}
+
+
+def figure_shard(figure, df):
+    """
+    returns the shard of figure for df: the traces of both scenarios as
+    plotly json, the scenario of each trace, the layout and, for the figures
+    in COMBINE, what they need to know about df
+    """
+    fig = figure(df, df).to_plotly_json()
+    traces, sides = [], []
+    for trace in fig["data"]:
+        side = SIDES.get(trace.get("marker", {}).get("color"))
+        # traces which belong to neither scenario (the lines between the
+        # scenarios in plot_quality_difference) are made by combine
+        if side is not None:
+            # plotly gives every trace a random uid, which would make the
+            # shards of identical figures differ
+            trace.pop("uid", None)
+            traces.append(trace)
+            sides.append(side)
+    shard = {"traces": traces, "sides": sides}
+    if figure in COMBINE:
+        shard["extra"] = COMBINE[figure][1](df)
+    layout = fig["layout"]
+    if figure is plot_market_entry:
+        # the axis ranges depend on both scenarios, see entry_limits
+        layout["xaxis"].pop("range", None)
+        layout["xaxis2"].pop("range", None)
+    shard["layout"] = layout
+    return shard
+
+
+def combine(figure, shard1, shard2):
+    """
+    returns the figure (as plotly json) with the output of shard1 as scenario 1
+    and the output of shard2 as scenario 2. The traces are shared with the
+    shards, so neither must be changed afterwards
+    """
+    shards = [shard1, shard2]
+    layout = copy.deepcopy(shard1["layout"])
+    data = [shards[side - 1]["traces"][i] for i, side in enumerate(shard1["sides"])]
+    if figure in COMBINE:
+        data = COMBINE[figure][2](layout, shard1["extra"], shard2["extra"]) + data
+    return {"data": data, "layout": layout}
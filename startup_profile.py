@@ -0,0 +1,191 @@
+"""
+Measures how long the app takes to start
+
+    python startup_profile.py imports     # which imports take the time
+    python startup_profile.py cold-start  # time until the server answers
+
+Every measurement runs in a fresh python process. `cold-start --record FILE`
+appends the result as a line of json to FILE, to track it over time.
+"""
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from loadtest import TABS, store_payload
+
+# modules which the app imports itself, plus the app
+MODULES = [
+    "numpy",
+    "pandas",
+    "tables",
+    "plotly.graph_objs",
+    "plotly.tools",
+    "dash",
+    "dash_core_components",
+    "dash_html_components",
+    "dash_bootstrap_components",
+    "figures",
+    "config",
+    "odi-app",
+]
+
+# the values the input widgets start with
+DEFAULT_SCENARIO = {
+    "-num-big-firms": 1,
+    "-privacy-concern": "medium",
+    "-loyalty": "medium",
+    "-openness": "medium",
+    "-shock-num": 1,
+    "-privacy-onoff": [],
+}
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import(module, env=None):
+    code = (
+        "import importlib, time; t = time.perf_counter(); "
+        "importlib.import_module({!r}); print(time.perf_counter() - t)".format(module)
+    )
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=HERE, env=env)
+    return float(out.decode().split()[-1])
+
+
+def importtime_breakdown(module, top):
+    """
+    per module self and cumulative import times from `python -X importtime`
+    """
+    code = "import importlib; importlib.import_module({!r})".format(module)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=HERE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    rows = []
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    print("slowest imports of {} (ms)".format(module))
+    print("{:>10} {:>10}  module".format("self", "cumulative"))
+    for self_us, cumulative_us, name in sorted(rows, reverse=True)[:top]:
+        print("{:>10.1f} {:>10.1f} {}".format(self_us / 1000, cumulative_us / 1000, name))
+    print()
+
+
+def imports(args):
+    # the -X importtime option only exists from python 3.7
+    if sys.version_info >= (3, 7):
+        importtime_breakdown("odi-app", args.top)
+    print("time to import each module in a fresh interpreter (s), including its dependencies")
+    for module in MODULES:
+        print("{:>8.3f}  {}".format(time_import(module), module))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(request, proc, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("the app exited with code {}".format(proc.returncode))
+        try:
+            with urllib.request.urlopen(request, timeout=timeout):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.05)
+    raise RuntimeError("the app did not answer within {} s".format(timeout))
+
+
+def cold_start_once(fast_start, timeout):
+    port = free_port()
+    url = "http://127.0.0.1:{}".format(port)
+    env = dict(os.environ, PORT=str(port), DASH_DEBUG="0", FAST_START="1" if fast_start else "0")
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "odi-app.py"], cwd=HERE, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for(url + "/_dash-layout", proc, timeout)
+        layout = time.perf_counter() - start
+        # the store callbacks need the dataset, so this is when the app is fully usable
+        data = json.dumps(store_payload(TABS[0], 1, 0, DEFAULT_SCENARIO)).encode("utf-8")
+        wait_for(
+            urllib.request.Request(
+                url + "/_dash-update-component", data=data,
+                headers={"Content-Type": "application/json"},
+            ),
+            proc,
+            timeout,
+        )
+        ready = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+    return layout, ready
+
+
+def cold_start(args):
+    results = {}
+    for fast_start in [False, True]:
+        runs = [cold_start_once(fast_start, args.timeout) for _ in range(args.repeat)]
+        mode = "fast_start" if fast_start else "default"
+        results[mode] = {
+            "serving_s": min(r[0] for r in runs),
+            "data_ready_s": min(r[1] for r in runs),
+        }
+        print(
+            "{:<11} serving after {:.2f} s, data ready after {:.2f} s (best of {})".format(
+                mode, results[mode]["serving_s"], results[mode]["data_ready_s"], args.repeat
+            )
+        )
+    if args.record:
+        try:
+            commit = subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        with open(args.record, "a") as fh:
+            record = {
+                "date": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+                "commit": commit,
+                "python": sys.version.split()[0],
+                "results": results,
+            }
+            fh.write(json.dumps(record) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+    p = sub.add_parser("imports", help="import time breakdown")
+    p.add_argument("--top", type=int, default=25, help="number of modules to show")
+    p.set_defaults(func=imports)
+    p = sub.add_parser("cold-start", help="time from process start until the app answers")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--timeout", type=float, default=300)
+    p.add_argument("--record", help="append the result to this file (json lines)")
+    p.set_defaults(func=cold_start)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+/*
+ * Static version of the app (see build_static.py).
+ *
+ * manifest.json maps the parameters of a scenario to an output number, and
+ * (tab, output) to a shard: the figure of that tab rendered with the output
+ * as both scenarios. A figure for two outputs is made of the scenario 1
+ * traces of the first shard and the scenario 2 traces of the second.
+ */
+(function () {
+  "use strict";
+
+  var GREY = "#eaeaea";
+  var requests = {};
+  var manifest;
+  var state = { tab: null, outputs: [null, null] };
+
+  function fetchJSON(url) {
+    // shards never change (their name is their content), so fetch them once
+    if (!requests[url]) {
+      requests[url] = fetch(url).then(function (response) {
+        if (!response.ok) {
+          throw new Error(url + ": " + response.status);
+        }
+        return response.json();
+      });
+    }
+    return requests[url];
+  }
+
+  function shard(tab, output) {
+    return fetchJSON("shards/" + manifest.shards[tab][output]);
+  }
+
+  // figures where the two scenarios depend on each other
+  var combine = {
+    // both plots of the market entry figure share the range of their x axis
+    "entry-limits": function (layout, extra1, extra2) {
+      var limits = [
+        Math.min(extra1.limits[0], extra2.limits[0]),
+        Math.max(extra1.limits[1], extra2.limits[1])
+      ];
+      layout.xaxis.range = limits;
+      layout.xaxis2.range = limits;
+      return [];
+    },
+    // lines between the qualities of the categories offered in both scenarios
+    "quality-lines": function (layout, extra1, extra2) {
+      var quality2 = {};
+      extra2.category.forEach(function (c, i) { quality2[c] = extra2.quality[i]; });
+      var lines = [];
+      extra1.category.forEach(function (c, i) {
+        var q1 = extra1.quality[i];
+        var q2 = quality2[c];
+        if (q1 && q2) {
+          lines.push({
+            type: "scatter", x: ["Scenario 1", "Scenario 2"], y: [q1, q2], mode: "lines",
+            showlegend: false, line: { color: GREY }, hoverinfo: "skip"
+          });
+        }
+      });
+      return lines;
+    }
+  };
+
+  function figure(tab, output1, output2) {
+    return Promise.all([shard(tab.id, output1), shard(tab.id, output2)]).then(function (shards) {
+      return fetchJSON("shards/" + shards[0].layout).then(function (layout) {
+        layout = JSON.parse(JSON.stringify(layout));
+        var data = shards[0].sides.map(function (side, i) {
+          return shards[side - 1].traces[i];
+        });
+        if (tab.combine) {
+          data = combine[tab.combine](layout, shards[0].extra, shards[1].extra).concat(data);
+        }
+        return { data: data, layout: layout };
+      });
+    });
+  }
+
+  function render() {
+    var tab = manifest.tabs.filter(function (t) { return t.id === state.tab; })[0];
+    document.getElementById("tab-text").textContent = tab.text;
+    Array.prototype.forEach.call(document.querySelectorAll("#tabs button"), function (button) {
+      button.className = "custom-tab" + (button.value === tab.id ? " custom-tab--selected" : "");
+    });
+    var outputs = state.outputs;
+    figure(tab, outputs[0], outputs[1]).then(function (fig) {
+      // only draw if nothing else has been selected meanwhile
+      if (state.tab === tab.id && state.outputs === outputs) {
+        Plotly.react("graph", fig.data, fig.layout);
+      }
+    });
+  }
+
+  function checked(name) {
+    var input = document.querySelector('input[name="' + name + '"]:checked');
+    return input ? input.value : null;
+  }
+
+  function scenarioOutput(scen) {
+    var shock = document.querySelector('input[name="' + scen + '-privacy-onoff"]').checked
+      ? checked(scen + "-shock-num")
+      : "0";
+    var values = {
+      n_init_big_firms: checked(scen + "-num-big-firms"),
+      mean_cons_concern: checked(scen + "-privacy-concern"),
+      w_loyal_firm: checked(scen + "-loyalty"),
+      scen_number_of_firms: shock,
+      openness_lower: checked(scen + "-openness")
+    };
+    var key = manifest.scenario_columns.map(function (c) { return values[c]; }).join("|");
+    return manifest.scenarios[key];
+  }
+
+  function apply() {
+    state.outputs = [scenarioOutput("scen1"), scenarioOutput("scen2")];
+    render();
+  }
+
+  function toggleShock(scen) {
+    var on = document.querySelector('input[name="' + scen + '-privacy-onoff"]').checked;
+    var radios = document.querySelector("#" + scen + " .shock-num");
+    radios.classList.toggle("disabled", !on);
+    Array.prototype.forEach.call(radios.querySelectorAll("input"), function (input) {
+      input.disabled = !on;
+    });
+  }
+
+  fetchJSON("manifest.json").then(function (m) {
+    manifest = m;
+    var tabs = document.getElementById("tabs");
+    manifest.tabs.forEach(function (tab) {
+      var button = document.createElement("button");
+      button.value = tab.id;
+      button.textContent = tab.label;
+      button.addEventListener("click", function () {
+        state.tab = tab.id;
+        render();
+      });
+      tabs.appendChild(button);
+    });
+    ["scen1", "scen2"].forEach(function (scen) {
+      document.querySelector('input[name="' + scen + '-privacy-onoff"]')
+        .addEventListener("change", function () { toggleShock(scen); });
+      toggleShock(scen);
+    });
+    document.getElementById("apply-button").addEventListener("click", apply);
+    state.tab = manifest.tabs[0].id;
+    apply();
+  });
+})();
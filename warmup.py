@@ -0,0 +1,203 @@
+"""
+Filling the figure cache in the background, starting with the most popular figures
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from werkzeug.wsgi import ClosingIterator
+
+from dataset import DatasetUnavailable
+
+try:
+    import fcntl
+except ImportError:
+    # windows, where the app only runs in one process with the development server
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class AccessStats:
+    """
+    Counts how often each figure (tab, output of scenario 1, output of scenario 2)
+    is requested. The counts are saved to a json file every few minutes and at
+    exit, and added to what is already in the file, so that several workers
+    and restarts all contribute to the same histogram. Workers take turns to
+    update the file, using a lock on `<path>.lock`.
+    """
+
+    def __init__(self, path, save_interval=300):
+        self.path = path
+        self.save_interval = save_interval
+        self.counts = Counter()
+        self._unsaved = Counter()
+        self._lock = threading.Lock()
+        self._saver = None
+
+    def record(self, key):
+        with self._lock:
+            self.counts[key] += 1
+            self._unsaved[key] += 1
+
+    def most_common(self, n=None):
+        with self._lock:
+            return [key for key, _ in self.counts.most_common(n)]
+
+    def _read(self):
+        try:
+            with open(self.path) as fh:
+                return Counter({tuple(k): c for *k, c in json.load(fh)})
+        except (OSError, ValueError):
+            return Counter()
+
+    def load(self):
+        with self._lock:
+            self.counts = self._read() + self._unsaved
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.path + ".lock", "a") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            # closing the file releases the lock
+            yield
+
+    def save(self):
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, Counter()
+        if not unsaved:
+            return
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            # without the lock, workers saving at the same time (e.g. all of
+            # them at exit) would each overwrite the others' counts
+            with self._file_lock():
+                counts = self._read() + unsaved
+                with open(tmp, "w") as fh:
+                    json.dump([list(k) + [c] for k, c in counts.most_common()], fh)
+                os.replace(tmp, self.path)
+        except OSError:
+            logger.exception("could not save access stats to %s", self.path)
+            with self._lock:
+                self._unsaved += unsaved
+
+    def _save_periodically(self):
+        while True:
+            time.sleep(self.save_interval)
+            self.save()
+
+    def start_saving(self):
+        if self._saver is None or not self._saver.is_alive():
+            self._saver = threading.Thread(target=self._save_periodically, name="access-stats", daemon=True)
+            self._saver.start()
+            atexit.register(self.save)
+
+
+class WarmupScheduler:
+    """
+    Builds the most requested figures into the cache in the background,
+    whenever a process starts and whenever a new version of the dataset is loaded.
+
+    build(dataset, key) computes and caches the figure for key. Warm-up
+    pauses while requests are being served (see `wsgi_middleware`) and stops
+    once the cache is max_fill full, so it never pushes out figures that
+    users actually asked for.
+    """
+
+    def __init__(self, dataset_manager, stats, cache, build, max_items=500, max_fill=0.8, workers=1):
+        self.dataset_manager = dataset_manager
+        self.stats = stats
+        self.cache = cache
+        self.build = build
+        self.max_items = max_items
+        self.max_fill = max_fill
+        self.workers = workers
+        self._live = 0
+        self._idle = threading.Condition()
+        self._executor = None
+        self._pid = None
+        dataset_manager.subscribe(self._on_new_version)
+
+    def _request_started(self):
+        with self._idle:
+            self._live += 1
+
+    def _request_finished(self):
+        with self._idle:
+            self._live -= 1
+            self._idle.notify_all()
+
+    def wsgi_middleware(self, app):
+        """
+        wraps a WSGI app, so that warm-up waits for all of its requests, until
+        their responses have been sent (which matters for streamed ones)
+        """
+
+        def wrapped(environ, start_response):
+            self._request_started()
+            try:
+                body = app(environ, start_response)
+            except BaseException:
+                self._request_finished()
+                raise
+            return ClosingIterator(body, self._request_finished)
+
+        return wrapped
+
+    def _wait_until_idle(self):
+        with self._idle:
+            self._idle.wait_for(lambda: self._live == 0)
+
+    def _on_new_version(self, dataset):
+        # the dataset may be loaded in a process which does not serve requests
+        # (e.g. the gunicorn master), which must not start any threads
+        if self._pid == os.getpid():
+            self.schedule()
+
+    def start(self):
+        """
+        starts warming up the cache; call once in every process serving requests
+        """
+        self._pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.stats.load()
+        self.stats.start_saving()
+        self.schedule()
+
+    def schedule(self):
+        self._executor.submit(self._schedule)
+
+    def _schedule(self):
+        try:
+            dataset = self.dataset_manager.current()
+        except DatasetUnavailable:
+            # scheduled again by _on_new_version once the dataset is loaded
+            return
+        keys = self.stats.most_common(self.max_items)
+        logger.info("warming up %s figures for dataset version %s", len(keys), dataset.version[:12])
+        for key in keys:
+            self._executor.submit(self._warm, dataset, key)
+
+    def _warm(self, dataset, key):
+        if dataset is not self.dataset_manager.current():
+            return  # superseded by a newer version
+        if self.cache.nbytes >= self.max_fill * self.cache.max_bytes:
+            return
+        if self.cache.contains(dataset.version, key):
+            return
+        _, st1, st2 = key
+        if not (dataset.has_output(st1) and dataset.has_output(st2)):
+            return
+        self._wait_until_idle()
+        try:
+            self.build(dataset, key)
+        except Exception:
+            logger.exception("could not warm up %s", key)
+